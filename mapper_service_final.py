@@ -4,25 +4,30 @@ Production-ready NPHIES Mapper (HL7 v2.5.1 & IHE ITI-41 ebXML)
 - JSON -> ITI-41 (ProvideAndRegisterDocumentSet-b)
 - ITI-41 -> JSON (namespace-robust parsing)
 - HL7 conformance check via hl7apy (optional)
-- XSD validation stub for ebXML via lxml (optional)
+- XSD validation stub for ebXML via lxml
 - MTOM/XOP stub for attachments (placeholder)
 """
 
 from fastapi import FastAPI, HTTPException, Response, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, StringConstraints, field_validator
+from typing import Optional, List, Dict, Any, Tuple, Union, BinaryIO, Annotated
 from datetime import datetime
+import os
 import uuid
 import re
+import functools
 import base64
 import hashlib
-import xml.etree.ElementTree as ET
 import io
 import logging
-from requests_toolbelt import MultipartEncoder
+import orjson
+from lxml import etree as ET
+from xml.sax.saxutils import escape as xml_escape
 
 
 # ----------------------------
@@ -31,7 +36,6 @@ from requests_toolbelt import MultipartEncoder
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 )
-logger = logging.getLogger("mapper_service")
 
 
 # Optional libraries (used if installed; graceful fallback otherwise)
@@ -46,47 +50,59 @@ try:
 except Exception:
     HL7APY_AVAILABLE = False
 
-try:
-    from lxml import etree as lxml_etree
-
-    LXML_AVAILABLE = True
-except Exception:
-    LXML_AVAILABLE = False
-else:
-    # small reference to avoid unused-import warnings when lxml is installed
-    _ = lxml_etree
-
 # ----------------------------
 # App + logging
 # ----------------------------
-app = FastAPI(title="NPHIES Mapper — Production", version="1.2")
+app = FastAPI(
+    title="NPHIES Mapper — Production",
+    version="1.2",
+    default_response_class=ORJSONResponse,
+)
 logger = logging.getLogger("mapper")
 
-# Enable CORS for testing
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS is only needed when browser-based tools call the API directly; machine
+# clients (HIEs, the node bridge) never send preflights. It stays off unless
+# MAPPER_CORS_ORIGINS lists the allowed origins (comma separated).
+CORS_ORIGINS = [
+    o.strip() for o in os.getenv("MAPPER_CORS_ORIGINS", "").split(",") if o.strip()
+]
+if CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    logger.warning(f"Validation failed: {exc.errors()}")
+    logger.warning("Validation failed: %s", exc.errors())
     # Return JSON formatted validation errors instead of the default HTML
-    return JSONResponse(
+    # jsonable_encoder: errors may carry the raised ValueError in their ctx
+    return ORJSONResponse(
         status_code=422,
-        content={"detail": exc.errors(), "body": exc.body},
+        content=jsonable_encoder({"detail": exc.errors(), "body": exc.body}),
     )
 
 
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    # Starlette re-raises after sending this, so the server still logs the
+    # traceback and AccessLogMiddleware records the 500
+    return ORJSONResponse(status_code=500, content={"detail": str(exc)})
+
+
 # ----------------------------
 # Constants & namespaces
 # ----------------------------
 ASSIGNING_AUTHORITY_HEALTH_ID = "2.16.840.1.113883.3.3731.1.1.100.1"
 NATIONAL_ORG_ROOT = "2.16.840.1.113883.3.3731"
 HL7_VERSION = "2.5.1"
+HL7_MEDIA_TYPE = "application/hl7-v2"
+SOAP_MEDIA_TYPE = "application/soap+xml"
+HL7_SEGMENT_SEP = "\r"
+HL7_FIELD_SEP = "|"
 
 SUBMISSIONSET_UNIQUEID_SCHEME = "urn:uuid:96fdda7c-d067-4183-912e-bf5ee74998a8"
 UNIQUEID_SCHEME = "urn:uuid:58a6f841-87b3-4a3e-92fd-a8ffeff98427"
@@ -100,9 +116,102 @@ SOAP_NS = {
     "rim": "urn:oasis:names:tc:ebxml-regrep:xsd:rim:3.0",
     "lcm": "urn:oasis:names:tc:ebxml-regrep:xsd:lcm:3.0",
 }
-# register prefixes to preserve them on output where possible
-for p, ns in SOAP_NS.items():
-    ET.register_namespace(p, ns)
+XOP_NS = "http://www.w3.org/2004/08/xop/include"
+
+# Clark-notation tag names, formatted once instead of per element written
+_TAG_ENVELOPE = "{%s}Envelope" % SOAP_NS["s"]
+_TAG_HEADER = "{%s}Header" % SOAP_NS["s"]
+_TAG_BODY = "{%s}Body" % SOAP_NS["s"]
+_TAG_FAULT = "{%s}Fault" % SOAP_NS["s"]
+_TAG_ACTION = "{%s}Action" % SOAP_NS["a"]
+_TAG_MESSAGE_ID = "{%s}MessageID" % SOAP_NS["a"]
+_TAG_TO = "{%s}To" % SOAP_NS["a"]
+_TAG_PNR_REQUEST = "{%s}ProvideAndRegisterDocumentSetRequest" % SOAP_NS["xds"]
+_TAG_SUBMIT_OBJECTS = "{%s}SubmitObjectsRequest" % SOAP_NS["lcm"]
+_TAG_OBJECT_LIST = "{%s}RegistryObjectList" % SOAP_NS["rim"]
+_TAG_REGPKG = "{%s}RegistryPackage" % SOAP_NS["rim"]
+_TAG_EXTRINSIC = "{%s}ExtrinsicObject" % SOAP_NS["rim"]
+_TAG_ASSOCIATION = "{%s}Association" % SOAP_NS["rim"]
+_TAG_CLASSIF = "{%s}Classification" % SOAP_NS["rim"]
+_TAG_EXTID = "{%s}ExternalIdentifier" % SOAP_NS["rim"]
+_TAG_NAME = "{%s}Name" % SOAP_NS["rim"]
+_TAG_DESCRIPTION = "{%s}Description" % SOAP_NS["rim"]
+_TAG_LOCALIZED = "{%s}LocalizedString" % SOAP_NS["rim"]
+_TAG_SLOT = "{%s}Slot" % SOAP_NS["rim"]
+_TAG_VALUELIST = "{%s}ValueList" % SOAP_NS["rim"]
+_TAG_VALUE = "{%s}Value" % SOAP_NS["rim"]
+_TAG_XOP_INCLUDE = "{%s}Include" % XOP_NS
+
+_RE_NON_DIGIT = re.compile(r"\D")
+_RE_DOB_TAIL = re.compile(r"[-:T].*")
+_RE_HL7_TS = re.compile(r"^\d{8,14}$")
+# a skeleton token is either an escaped '%%' (no group) or a %(name)s slot
+_RE_SKELETON_TOKEN = re.compile(rb"%(?:%|\((\w+)\)s)")
+
+# Enforced by pydantic-core when the models are validated:
+# patient_id must read '<Id>^^^&<ASSIGNING_AUTHORITY_HEALTH_ID>&ISO',
+# source_id (when non-empty) must start with the national OID root
+_PATIENT_ID_PATTERN = (
+    r"^[^\^]+\^\^\^&" + re.escape(ASSIGNING_AUTHORITY_HEALTH_ID) + r"&ISO$"
+)
+_SOURCE_ID_PATTERN = r"^(?:" + re.escape(NATIONAL_ORG_ROOT) + r"|$)"
+
+# PID-3 for the mandatory national health id is '<Id>' + this fixed CX tail
+_PID3_HEALTH_ID_SUFFIX = f"^^^{ASSIGNING_AUTHORITY_HEALTH_ID}^ISO"
+_PID3_AUTHORITY_ERROR = (
+    "Patient first identifier assigning_authority must be "
+    + ASSIGNING_AUTHORITY_HEALTH_ID
+)
+
+# upper bound of generated ids per ITI-41 envelope: message id, submission
+# and document ids, four ExternalIdentifiers, two Classifications, Association
+ITI41_MAX_UUIDS = 10
+
+# SOAPInput fields that shape the cached ITI-41 envelope skeleton; the
+# document itself and anything generated per request are filled in later
+_ITI41_META_FIELDS = (
+    "repository_address",
+    "patient_id",
+    "class_code",
+    "type_code",
+    "practice_setting_code",
+    "unique_id",
+    "object_type",
+    "mime_type",
+    "creation_time",
+    "source_id",
+    "repository_unique_id",
+)
+# message_id is left out: WS-Addressing wants a fresh one per message, so it
+# is a per-request slot rather than part of the cache key
+_ITI41_SOAP_KEYS = ("action", "to")
+
+# documents of this decoded size or larger are sent as MTOM/XOP
+_MTOM_THRESHOLD_BYTES = 256 * 1024
+
+# the binary MTOM part is streamed in slices of this many bytes
+MTOM_CHUNK_SIZE = 64 * 1024
+
+# fixed MTOM framing; only the boundary, cid and document mime type vary.
+# The root part is the SOAP 1.2 envelope; the document part's Content-ID is
+# what the envelope's <xop:Include href="cid:..."> resolves to
+_MTOM_CONTENT_TYPE = (
+    'multipart/related; type="application/xop+xml"; boundary="%s"; '
+    'start="<rootpart>"; start-info="application/soap+xml"'
+)
+_MTOM_DELIMITER = b"--%b\r\n"
+_MTOM_ROOT_PART_HEADERS = (
+    b"Content-Type: application/xop+xml; charset=UTF-8; "
+    b'type="application/soap+xml"\r\n'
+    b"Content-Transfer-Encoding: 8bit\r\n"
+    b"Content-ID: <rootpart>\r\n\r\n"
+)
+_MTOM_DOC_PART_HEADERS = (
+    b"Content-Type: %b\r\n"
+    b"Content-Transfer-Encoding: binary\r\n"
+    b"Content-ID: <%b>\r\n\r\n"
+)
+_MTOM_CLOSE = b"\r\n--%b--\r\n"
 
 
 # ----------------------------
@@ -123,10 +232,11 @@ class PatientModel(BaseModel):
     sex: Optional[str]
 
     @field_validator("dob")
+    @classmethod
     def normalize_dob(cls, v):
         if not v:
             return v
-        return re.sub(r"[-:T].*", "", v)[:8]
+        return _RE_DOB_TAIL.sub("", v)[:8]
 
 
 class PD1Model(BaseModel):
@@ -193,7 +303,9 @@ class HL7FullInput(BaseModel):
 class SOAPInput(BaseModel):
     soap: Dict[str, Any]
     repository_address: Optional[str] = None
-    patient_id: str
+    patient_id: Annotated[
+        str, StringConstraints(strip_whitespace=True, pattern=_PATIENT_ID_PATTERN)
+    ]
     class_code: Optional[str] = None
     type_code: Optional[str] = None
     practice_setting_code: Optional[str] = None
@@ -202,24 +314,11 @@ class SOAPInput(BaseModel):
     document_base64: Optional[str] = None
     mime_type: Optional[str] = Field(default="text/xml")
     creation_time: Optional[str] = None
-    source_id: Optional[str] = None
+    source_id: Optional[str] = Field(default=None, pattern=_SOURCE_ID_PATTERN)
     repository_unique_id: Optional[str] = None
 
-    @field_validator("patient_id")
-    def patient_id_must_be_xds_format(cls, v):
-        if not v:
-            raise ValueError("patient_id is required in XDS format")
-        v = v.strip()
-        pattern = (
-            r"^[^\^]+(\^\^\^&" + re.escape(ASSIGNING_AUTHORITY_HEALTH_ID) + r"&ISO)$"
-        )
-        if not re.match(pattern, v):
-            raise ValueError(
-                f"patient_id must be formatted as '<Id>^^^&{ASSIGNING_AUTHORITY_HEALTH_ID}&ISO'"
-            )
-        return v
-
     @field_validator("creation_time")
+    @classmethod
     def creation_time_must_be_iso_or_hl7(cls, v):
         if not v:
             return v
@@ -227,19 +326,19 @@ class SOAPInput(BaseModel):
             datetime.fromisoformat(v.replace("Z", "+00:00"))
             return v
         except Exception:
-            if re.match(r"^\d{8,14}$", v):
+            if _RE_HL7_TS.match(v):
                 return v
             raise ValueError(
                 "creation_time must be ISO8601 or HL7 TS (YYYYMMDD[HHMMSS])"
             )
 
-    @field_validator("source_id")
-    def source_id_must_start_with_root(cls, v):
-        if not v:
-            return v
-        if not v.startswith(NATIONAL_ORG_ROOT):
-            raise ValueError(f"source_id must start with {NATIONAL_ORG_ROOT}")
-        return v
+
+class HL7Body(BaseModel):
+    hl7: str = Field(min_length=1)
+
+
+class XmlBody(BaseModel):
+    xml: str = Field(min_length=1)
 
 
 
@@ -249,53 +348,138 @@ class SOAPInput(BaseModel):
 def ts_to_hl7(ts: Optional[str]) -> str:
     if not ts:
         return datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    return _normalize_ts(ts)
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_ts(ts: str) -> str:
+    # pure in ts; the wall-clock default above is deliberately never cached
     try:
         dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
         return dt.strftime("%Y%m%d%H%M%S")
     except Exception:
-        digits = re.sub(r"\D", "", ts)
+        digits = _RE_NON_DIGIT.sub("", ts)
         return digits[:14]
 
 
+_HL7_ESCAPE = str.maketrans({"|": "\\F\\", "^": "\\S\\", "&": "\\T\\", "~": "\\R\\"})
+
+
 def escape_hl7_field(s: Optional[str]) -> str:
     if s is None:
         return ""
-    return (
-        s.replace("|", "\\F\\")
-        .replace("^", "\\S\\")
-        .replace("&", "\\T\\")
-        .replace("~", "\\R\\")
-    )
+    return s.translate(_HL7_ESCAPE)
+
+
+def _esc(s: Optional[str]) -> str:
+    # segment-builder shorthand: skips translate() for None/empty values
+    return s.translate(_HL7_ESCAPE) if s else ""
+
+
+def _sha1():
+    # SHA-1 is mandated by the XDS.b hash slot, not used for security here
+    return hashlib.sha1(usedforsecurity=False)
+
+
+def sha1_and_size(b: Union[bytes, bytearray, memoryview, BinaryIO]) -> Tuple[str, str]:
+    """
+    Hex SHA-1 and byte size of a document given as bytes or a seekable binary
+    file object; files are hashed in chunks without being read into memory.
+    """
+    if isinstance(b, (bytes, bytearray, memoryview)):
+        h = _sha1()
+        h.update(b)
+        return h.hexdigest(), str(len(b))
+    b.seek(0)
+    h = hashlib.file_digest(b, _sha1)
+    return h.hexdigest(), str(b.seek(0, io.SEEK_END))
+
+
+def decode_document(
+    document_base64: str, embed: bool = True
+) -> Tuple[bytes, Optional[bytes]]:
+    """
+    Return the document bytes and the ASCII base64 bytes to embed for them.
+    Well-formed input is embedded as received instead of being re-encoded;
+    with embed=False (MTOM) no base64 is returned at all.
+    """
+    try:
+        # the one ASCII copy serves both the decoder and the embedded text
+        encoded = document_base64.encode("ascii")
+        return base64.b64decode(encoded, validate=True), encoded if embed else None
+    except ValueError:
+        pass
+    # lenient path: stray characters are dropped, non-base64 is taken as raw text
+    try:
+        doc_bytes = base64.b64decode(document_base64)
+    except Exception:
+        doc_bytes = document_base64.encode("utf-8")
+    return doc_bytes, base64.b64encode(doc_bytes) if embed else None
+
+
+def add_slot(xf, name, values):
+    with xf.element(_TAG_SLOT, {"name": name}):
+        with xf.element(_TAG_VALUELIST):
+            for v in values:
+                with xf.element(_TAG_VALUE):
+                    xf.write(v)
+
+
+def _uuid_batch(n: int) -> List[uuid.UUID]:
+    """
+    n random (version 4) UUIDs cut from a single os.urandom read.
+    """
+    buf = os.urandom(16 * n)
+    return [uuid.UUID(bytes=buf[i : i + 16], version=4) for i in range(0, 16 * n, 16)]
 
 
-def sha1_and_size(b: bytes):
-    h = hashlib.sha1(b).hexdigest()
-    return h, str(len(b))
+def add_external_identifier(xf, entry_id, registry_object, scheme, value):
+    attrs = {
+        "id": entry_id,
+        "registryObject": registry_object,
+        "identificationScheme": scheme,
+    }
+    with xf.element(_TAG_EXTID, attrs):
+        with xf.element(_TAG_VALUE):
+            xf.write(value)
 
 
-def add_slot(parent, name, values):
-    slot = ET.SubElement(parent, "{%s}Slot" % SOAP_NS["rim"])
-    slot.set("name", name)
-    vl = ET.SubElement(slot, "{%s}ValueList" % SOAP_NS["rim"])
-    for v in values:
-        ET.SubElement(vl, "{%s}Value" % SOAP_NS["rim"]).text = v
+def add_localized_name(xf, tag, value):
+    with xf.element(tag):
+        with xf.element(_TAG_LOCALIZED, {"value": value}):
+            pass
 
 
 # ----------------------------
 # HL7 builder & parser (preserve your original production logic)
 # ----------------------------
-def build_msh(hdr: MessageModel) -> str:
+def build_msh(hdr: MessageModel, dt: Optional[str] = None) -> str:
     enc = "^~\\&"
     sending_app = hdr.sending_app_oid or ""
     sending_fac = hdr.sending_facility or ""
     recv_app = hdr.receiving_app or ""
     recv_fac = hdr.receiving_facility or ""
-    dt = ts_to_hl7(hdr.message_datetime)
+    dt = dt or ts_to_hl7(hdr.message_datetime)
     msg_type = hdr.event
     ctrl = hdr.message_control_id or str(uuid.uuid4())
     proc = "P"
     ver = hdr.version or HL7_VERSION
-    return f"MSH|{enc}|{sending_app}|{sending_fac}|{recv_app}|{recv_fac}|{dt}||{msg_type}|{ctrl}|{proc}|{ver}"
+    return "|".join(
+        (
+            "MSH",
+            enc,
+            sending_app,
+            sending_fac,
+            recv_app,
+            recv_fac,
+            dt,
+            "",
+            msg_type,
+            ctrl,
+            proc,
+            ver,
+        )
+    )
 
 
 def build_pid(patient: PatientModel) -> str:
@@ -303,14 +487,17 @@ def build_pid(patient: PatientModel) -> str:
     if patient.identifiers and len(patient.identifiers) > 0:
         first = patient.identifiers[0]
         if first.assigning_authority != ASSIGNING_AUTHORITY_HEALTH_ID:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Patient first identifier assigning_authority must be {ASSIGNING_AUTHORITY_HEALTH_ID}",
-            )
-        pid3 = f"{first.id}^^^{first.assigning_authority}^ISO"
+            raise HTTPException(status_code=400, detail=_PID3_AUTHORITY_ERROR)
+        pid3 = first.id + _PID3_HEALTH_ID_SUFFIX
     name = ""
     if patient.name_family or patient.name_given or patient.middle_name:
-        name = f"{escape_hl7_field(patient.name_family or '')}^{escape_hl7_field(patient.name_given or '')}^{escape_hl7_field(patient.middle_name or '')}"
+        name = "^".join(
+            (
+                _esc(patient.name_family),
+                _esc(patient.name_given),
+                _esc(patient.middle_name),
+            )
+        )
     dob = patient.dob or ""
     sex = patient.sex or ""
     return f"PID|1||{pid3}||{name}||{dob}|{sex}"
@@ -318,14 +505,15 @@ def build_pid(patient: PatientModel) -> str:
 
 def json_to_hl7_full(payload: HL7FullInput) -> str:
     segments = []
-    segments.append(build_msh(payload.header))
+    # resolved once so MSH-7 and EVN-2 carry the same timestamp
+    msg_dt = ts_to_hl7(payload.header.message_datetime)
+    segments.append(build_msh(payload.header, msg_dt))
     evn_code = (
         payload.header.event.split("^")[-1]
         if "^" in payload.header.event
         else payload.header.event
     )
-    evn_time = ts_to_hl7(payload.header.message_datetime)
-    segments.append(f"EVN|{evn_code}|{evn_time}")
+    segments.append(f"EVN|{evn_code}|{msg_dt}")
     segments.append(build_pid(payload.patient))
 
     if payload.pd1:
@@ -343,12 +531,12 @@ def json_to_hl7_full(payload: HL7FullInput) -> str:
     if payload.visit:
         v = payload.visit
         attend_doc = f"{v.attending_doctor_id or ''}^{v.attending_doctor_family or ''}^{v.attending_doctor_given or ''}"
+        admit = ts_to_hl7(v.admit_datetime) if v.admit_datetime else ""
+        discharge = ts_to_hl7(v.discharge_datetime) if v.discharge_datetime else ""
         segments.append(
-            f"PV1|1|{v.patient_class or ''}|{v.location or ''}||||{attend_doc}|||||||||||||||{v.visit_number or ''}|{ts_to_hl7(v.admit_datetime) if v.admit_datetime else ''}|{ts_to_hl7(v.discharge_datetime) if v.discharge_datetime else ''}"
-        )
-        segments.append(
-            f"PV2|||{ts_to_hl7(v.admit_datetime) if v.admit_datetime else ''}|{ts_to_hl7(v.discharge_datetime) if v.discharge_datetime else ''}"
+            f"PV1|1|{v.patient_class or ''}|{v.location or ''}||||{attend_doc}|||||||||||||||{v.visit_number or ''}|{admit}|{discharge}"
         )
+        segments.append(f"PV2|||{admit}|{discharge}")
 
     if payload.mrg:
         prior_id = payload.mrg.get("prior_patient_id", "")
@@ -358,37 +546,86 @@ def json_to_hl7_full(payload: HL7FullInput) -> str:
     if payload.al1:
         for a in payload.al1:
             segments.append(
-                f"AL1|||{escape_hl7_field(a.get('allergen',''))}|{escape_hl7_field(a.get('reaction',''))}|{escape_hl7_field(a.get('severity',''))}"
+                "|".join(
+                    (
+                        "AL1",
+                        "",
+                        "",
+                        _esc(a.get("allergen")),
+                        _esc(a.get("reaction")),
+                        _esc(a.get("severity")),
+                    )
+                )
             )
 
     if payload.dg1:
         for d in payload.dg1:
             segments.append(
-                f"DG1|{d.get('set_id','1')}|{d.get('diagnosis_type','')}|{d.get('diagnosis_code','')}|{escape_hl7_field(d.get('diagnosis_desc',''))}"
+                "|".join(
+                    (
+                        "DG1",
+                        str(d.get("set_id", "1")),
+                        str(d.get("diagnosis_type", "")),
+                        str(d.get("diagnosis_code", "")),
+                        _esc(d.get("diagnosis_desc")),
+                    )
+                )
             )
 
     if payload.pr1:
         for p in payload.pr1:
             segments.append(
-                f"PR1|{p.get('set_id','1')}|{p.get('procedure_code','')}|{escape_hl7_field(p.get('procedure_desc',''))}"
+                "|".join(
+                    (
+                        "PR1",
+                        str(p.get("set_id", "1")),
+                        str(p.get("procedure_code", "")),
+                        _esc(p.get("procedure_desc")),
+                    )
+                )
             )
     if payload.nk1:
         for nk in payload.nk1:
             segments.append(
-                f"NK1||{escape_hl7_field(nk.name or '')}|{escape_hl7_field(nk.relationship or '')}|{escape_hl7_field(nk.phone_number or '')}"
+                "|".join(
+                    (
+                        "NK1",
+                        "",
+                        _esc(nk.name),
+                        _esc(nk.relationship),
+                        _esc(nk.phone_number),
+                    )
+                )
             )
     if payload.gt1:
         for gt in payload.gt1:
             segments.append(
-                f"GT1|{escape_hl7_field(gt.guarantor_number or '')}|{escape_hl7_field(gt.guarantor_name or '')}|{escape_hl7_field(gt.guarantor_address or '')}|{escape_hl7_field(gt.guarantor_phone or '')}"
+                "|".join(
+                    (
+                        "GT1",
+                        _esc(gt.guarantor_number),
+                        _esc(gt.guarantor_name),
+                        _esc(gt.guarantor_address),
+                        _esc(gt.guarantor_phone),
+                    )
+                )
             )
     if payload.in1:
         for ins in payload.in1:
             segments.append(
-                f"IN1|{escape_hl7_field(ins.insurance_plan_id or '')}|{escape_hl7_field(ins.insurance_company_id or '')}|{escape_hl7_field(ins.insurance_company_name or '')}|{escape_hl7_field(ins.insured_id or '')}|{escape_hl7_field(ins.insured_name or '')}"
+                "|".join(
+                    (
+                        "IN1",
+                        _esc(ins.insurance_plan_id),
+                        _esc(ins.insurance_company_id),
+                        _esc(ins.insurance_company_name),
+                        _esc(ins.insured_id),
+                        _esc(ins.insured_name),
+                    )
+                )
             )
 
-    hl7_msg = "\r".join(segments)
+    hl7_msg = HL7_SEGMENT_SEP.join(segments)
     # Optional HL7 conformance check (hl7apy)
     if HL7APY_AVAILABLE:
         try:
@@ -396,11 +633,129 @@ def json_to_hl7_full(payload: HL7FullInput) -> str:
             _ = hl7apy_parser.parse_message(hl7_msg, find_groups=False)
             logger.debug("hl7apy parsed message OK")
         except Exception as e:
-            logger.warning(f"hl7apy found issues parsing HL7: {e}")
+            logger.warning("hl7apy found issues parsing HL7: %s", e)
             # do not block output; but raise if you want strict conformance
     return hl7_msg
 
 
+# Segments are split at most this many times and padded to this length, so
+# handlers can index fields directly without bounds checks
+HL7_MAX_FIELDS = 30
+
+
+def _parse_msh(fields: List[str], result: Dict[str, Any]) -> None:
+    result["header"].update(
+        {
+            "sending_app_oid": fields[2],
+            "sending_facility": fields[3],
+            "receiving_app": fields[4],
+            "receiving_facility": fields[5],
+            "message_datetime": fields[6],
+            "event": fields[8],
+            "message_control_id": fields[9],
+            "version": fields[11],
+        }
+    )
+
+
+def _parse_evn(fields: List[str], result: Dict[str, Any]) -> None:
+    result["header"]["evn"] = fields[1]
+    result["header"]["evn_datetime"] = fields[2]
+
+
+def _parse_pid(fields: List[str], result: Dict[str, Any]) -> None:
+    # FIXED: use indexes that match typical ADT PID layout:
+    # PID|1||<id>||<family>^<given>^<middle>||<dob>|<sex>
+    result["patient"] = {
+        "identifiers": [fields[3]],
+        "name": fields[5],
+        "dob": fields[7],  # corrected index
+        "sex": fields[8],  # corrected index
+    }
+
+
+def _parse_pd1(fields: List[str], result: Dict[str, Any]) -> None:
+    result["pd1"] = {"vip": fields[1], "prior_ids": fields[2]}
+
+
+def _parse_pv1(fields: List[str], result: Dict[str, Any]) -> None:
+    result["visit"] = {
+        "patient_class": fields[2],
+        "location": fields[3],
+        "attending_doctor": fields[8],
+        "visit_number": fields[19],
+    }
+
+
+def _parse_pv2(fields: List[str], result: Dict[str, Any]) -> None:
+    if result["visit"] is None:
+        result["visit"] = {}
+    result["visit"]["admit"] = fields[3]
+    result["visit"]["discharge"] = fields[4]
+
+
+def _parse_mrg(fields: List[str], result: Dict[str, Any]) -> None:
+    result["mrg"] = {"prior_patient_id": fields[1], "prior_visit": fields[4]}
+
+
+def _parse_al1(fields: List[str], result: Dict[str, Any]) -> None:
+    result["al1"].append({"allergen": fields[3], "reaction": fields[4]})
+
+
+def _parse_dg1(fields: List[str], result: Dict[str, Any]) -> None:
+    result["dg1"].append({"code": fields[3], "desc": fields[4]})
+
+
+def _parse_pr1(fields: List[str], result: Dict[str, Any]) -> None:
+    result["pr1"].append({"code": fields[2], "desc": fields[3]})
+
+
+def _parse_nk1(fields: List[str], result: Dict[str, Any]) -> None:
+    result.setdefault("nk1", []).append(
+        {"name": fields[2], "relationship": fields[3], "phone_number": fields[4]}
+    )
+
+
+def _parse_gt1(fields: List[str], result: Dict[str, Any]) -> None:
+    result.setdefault("gt1", []).append(
+        {
+            "guarantor_number": fields[1],
+            "guarantor_name": fields[2],
+            "guarantor_address": fields[3],
+            "guarantor_phone": fields[4],
+        }
+    )
+
+
+def _parse_in1(fields: List[str], result: Dict[str, Any]) -> None:
+    result.setdefault("in1", []).append(
+        {
+            "insurance_plan_id": fields[1],
+            "insurance_company_id": fields[2],
+            "insurance_company_name": fields[3],
+            "insured_id": fields[4],
+            "insured_name": fields[5],
+        }
+    )
+
+
+_SEGMENT_HANDLERS = {
+    "MSH": _parse_msh,
+    "EVN": _parse_evn,
+    "PID": _parse_pid,
+    "PD1": _parse_pd1,
+    "PV1": _parse_pv1,
+    "PV2": _parse_pv2,
+    "MRG": _parse_mrg,
+    "AL1": _parse_al1,
+    "DG1": _parse_dg1,
+    "PR1": _parse_pr1,
+    "NK1": _parse_nk1,
+    "GT1": _parse_gt1,
+    "IN1": _parse_in1,
+}
+
+
 def hl7_full_to_json(hl7_msg: str) -> Dict[str, Any]:
     result = {
         "header": {},
@@ -412,101 +767,14 @@ def hl7_full_to_json(hl7_msg: str) -> Dict[str, Any]:
         "dg1": [],
         "pr1": [],
     }
-    segments = [s for s in hl7_msg.split("\r") if s.strip()]
-    for seg in segments:
-        fields = seg.split("|")
-        name = fields[0]
-        if name == "MSH":
-            result["header"].update(
-                {
-                    "sending_app_oid": fields[2] if len(fields) > 2 else "",
-                    "sending_facility": fields[3] if len(fields) > 3 else "",
-                    "receiving_app": fields[4] if len(fields) > 4 else "",
-                    "receiving_facility": fields[5] if len(fields) > 5 else "",
-                    "message_datetime": fields[6] if len(fields) > 6 else "",
-                    "event": fields[8] if len(fields) > 8 else "",
-                    "message_control_id": fields[9] if len(fields) > 9 else "",
-                    "version": fields[11] if len(fields) > 11 else "",
-                }
-            )
-        elif name == "EVN":
-            result["header"]["evn"] = fields[1] if len(fields) > 1 else ""
-            result["header"]["evn_datetime"] = fields[2] if len(fields) > 2 else ""
-        elif name == "PID":
-            # FIXED: use indexes that match typical ADT PID layout:
-            # PID|1||<id>||<family>^<given>^<middle>||<dob>|<sex>
-            result["patient"] = {
-                "identifiers": [fields[3] if len(fields) > 3 else ""],
-                "name": fields[5] if len(fields) > 5 else "",
-                "dob": fields[7] if len(fields) > 7 else "",  # corrected index
-                "sex": fields[8] if len(fields) > 8 else "",  # corrected index
-            }
-        elif name == "PD1":
-            result["pd1"] = {
-                "vip": fields[1] if len(fields) > 1 else "",
-                "prior_ids": fields[2] if len(fields) > 2 else "",
-            }
-        elif name == "PV1":
-            result["visit"] = {
-                "patient_class": fields[2] if len(fields) > 2 else "",
-                "location": fields[3] if len(fields) > 3 else "",
-                "attending_doctor": fields[8] if len(fields) > 8 else "",
-                "visit_number": fields[19] if len(fields) > 19 else "",
-            }
-        elif name == "PV2":
-            result.setdefault("visit", {})["admit"] = (
-                fields[3] if len(fields) > 3 else ""
-            )
-            result.setdefault("visit", {})["discharge"] = (
-                fields[4] if len(fields) > 4 else ""
-            )
-        elif name == "MRG":
-            result["mrg"] = {
-                "prior_patient_id": fields[1] if len(fields) > 1 else "",
-                "prior_visit": fields[4] if len(fields) > 4 else "",
-            }
-        elif name == "AL1":
-            result["al1"].append(
-                {
-                    "allergen": fields[3] if len(fields) > 3 else "",
-                    "reaction": fields[4] if len(fields) > 4 else "",
-                }
-            )
-        elif name == "DG1":
-            result["dg1"].append(
-                {
-                    "code": fields[3] if len(fields) > 3 else "",
-                    "desc": fields[4] if len(fields) > 4 else "",
-                }
-            )
-        elif name == "PR1":
-            result["pr1"].append(
-                {
-                    "code": fields[2] if len(fields) > 2 else "",
-                    "desc": fields[3] if len(fields) > 3 else "",
-                }
-            )
-        elif name == "NK1":
-            result.setdefault('nk1', []).append({
-                'name': fields[2] if len(fields) > 2 else "",
-                'relationship': fields[3] if len(fields) > 3 else "",
-                'phone_number': fields[4] if len(fields) > 4 else ""
-            })
-        elif name == "GT1":
-            result.setdefault('gt1', []).append({
-                'guarantor_number': fields[1] if len(fields) > 1 else "",
-                'guarantor_name': fields[2] if len(fields) > 2 else "",
-                'guarantor_address': fields[3] if len(fields) > 3 else "",
-                'guarantor_phone': fields[4] if len(fields) > 4 else ""
-            })
-        elif name == "IN1":
-            result.setdefault('in1', []).append({
-                'insurance_plan_id': fields[1] if len(fields) > 1 else "",
-                'insurance_company_id': fields[2] if len(fields) > 2 else "",
-                'insurance_company_name': fields[3] if len(fields) > 3 else "",
-                'insured_id': fields[4] if len(fields) > 4 else "",
-                'insured_name': fields[5] if len(fields) > 5 else ""
-            })
+    # blank and unknown segments both fall out at the handler lookup
+    for seg in hl7_msg.split(HL7_SEGMENT_SEP):
+        fields = seg.split(HL7_FIELD_SEP, HL7_MAX_FIELDS)
+        handler = _SEGMENT_HANDLERS.get(fields[0])
+        if handler is None:
+            continue
+        fields.extend([""] * (HL7_MAX_FIELDS - len(fields)))
+        handler(fields, result)
 
     return result
 
@@ -514,167 +782,289 @@ def hl7_full_to_json(hl7_msg: str) -> Dict[str, Any]:
 # ----------------------------
 # ITI-41 ebXML builder (full)
 # ----------------------------
-def build_iti41_ebxml(obj: SOAPInput) -> str:
-    if obj.source_id and not obj.source_id.startswith(NATIONAL_ORG_ROOT):
-        raise HTTPException(
-            status_code=400, detail=f"source_id must start with {NATIONAL_ORG_ROOT}"
+def _write_soap_header(xf, obj: SOAPInput, ids):
+    with xf.element(_TAG_HEADER):
+        with xf.element(_TAG_ACTION):
+            xf.write(
+                obj.soap.get(
+                    "action", "urn:ihe:iti:2007:ProvideAndRegisterDocumentSet-b"
+                )
+            )
+        with xf.element(_TAG_MESSAGE_ID):
+            if "message_id" in obj.soap:
+                xf.write(obj.soap["message_id"])
+            else:
+                xf.write(str(next(ids)))
+        with xf.element(_TAG_TO):
+            xf.write(obj.soap.get("to", obj.repository_address or ""))
+
+
+def _write_submission_set(
+    xf, obj: SOAPInput, ids, regpkg_id: str, submission_id: str, submission_time: str
+):
+    with xf.element(_TAG_REGPKG, {"id": regpkg_id}):
+        add_localized_name(xf, _TAG_NAME, "SubmissionSet")
+        add_external_identifier(
+            xf,
+            f"urn:uuid:{next(ids)}",
+            regpkg_id,
+            SUBMISSIONSET_UNIQUEID_SCHEME,
+            submission_id,
         )
+        add_slot(xf, "submissionTime", [submission_time])
+        if obj.source_id:
+            add_slot(xf, "sourceId", [obj.source_id])
+        if obj.repository_unique_id:
+            add_slot(xf, "repositoryUniqueID", [obj.repository_unique_id])
+
+
+def _write_document_entry(
+    xf,
+    obj: SOAPInput,
+    ids,
+    doc_id: str,
+    doc_digest: Optional[Tuple[str, str]],
+    creation_time: str,
+):
+    attrs = {
+        "id": doc_id,
+        "objectType": obj.object_type or OBJECTTYPE_ONDEMAND,
+        "mimeType": obj.mime_type or "text/xml",
+    }
+    with xf.element(_TAG_EXTRINSIC, attrs):
+        add_localized_name(xf, _TAG_NAME, "Clinical Document")
+        add_localized_name(xf, _TAG_DESCRIPTION, "Document (CDA or other)")
+        if obj.class_code:
+            cls_attrs = {
+                "classificationScheme": "urn:ksa-ehealth:classcodes:2023",
+                "classificationNode": obj.class_code,
+                "id": f"urn:uuid:{next(ids)}",
+            }
+            with xf.element(_TAG_CLASSIF, cls_attrs):
+                pass
+        if obj.type_code:
+            tcls_attrs = {
+                "classificationScheme": "urn:uuid:aa543740-bdda-424e-8c96-df4873be8500",
+                "classificationNode": obj.type_code,
+                "id": f"urn:uuid:{next(ids)}",
+            }
+            with xf.element(_TAG_CLASSIF, tcls_attrs):
+                pass
 
-    root = ET.Element("{%s}Envelope" % SOAP_NS["s"])
-    header = ET.SubElement(root, "{%s}Header" % SOAP_NS["s"])
-    body = ET.SubElement(root, "{%s}Body" % SOAP_NS["s"])
+        # ExternalIdentifiers
+        add_external_identifier(
+            xf, f"urn:uuid:{next(ids)}", doc_id, UNIQUEID_SCHEME, doc_id
+        )
+        add_external_identifier(
+            xf, f"urn:uuid:{next(ids)}", doc_id, UNIQUEID_SCHEME, obj.patient_id
+        )
+        if obj.source_id:
+            add_external_identifier(
+                xf, f"urn:uuid:{next(ids)}", doc_id, UNIQUEID_SCHEME, obj.source_id
+            )
 
-    ET.SubElement(header, "{%s}Action" % SOAP_NS["a"]).text = obj.soap.get(
-        "action", "urn:ihe:iti:2007:ProvideAndRegisterDocumentSet-b"
-    )
-    ET.SubElement(header, "{%s}MessageID" % SOAP_NS["a"]).text = obj.soap.get(
-        "message_id", str(uuid.uuid4())
-    )
-    ET.SubElement(header, "{%s}To" % SOAP_NS["a"]).text = obj.soap.get(
-        "to", obj.repository_address or ""
-    )
+        # creationTime slot
+        add_slot(xf, "creationTime", [creation_time])
+
+        if doc_digest is not None:
+            h, size = doc_digest
+            add_slot(xf, "hash", [h])
+            add_slot(xf, "size", [size])
+            fmt = (
+                "urn:ihe:iti:xds-sd:pdf:2008"
+                if "pdf" in (obj.mime_type or "").lower()
+                else "urn:ksa-ehealth:format:unknown"
+            )
+            add_slot(xf, "formatCode", [fmt])
 
-    pr = ET.SubElement(
-        body, "{%s}ProvideAndRegisterDocumentSetRequest" % SOAP_NS["xds"]
-    )
-    sor = ET.SubElement(pr, "{%s}SubmitObjectsRequest" % SOAP_NS["lcm"])
-    rol = ET.SubElement(sor, "{%s}RegistryObjectList" % SOAP_NS["rim"])
-
-    # SubmissionSet
-    submission_id = obj.unique_id or f"urn:uuid:{uuid.uuid4()}"
-    regpkg = ET.SubElement(rol, "{%s}RegistryPackage" % SOAP_NS["rim"])
-    regpkg.set("id", f"rs.{submission_id}")
-    name = ET.SubElement(regpkg, "{%s}Name" % SOAP_NS["rim"])
-    ET.SubElement(name, "{%s}LocalizedString" % SOAP_NS["rim"]).set(
-        "value", "SubmissionSet"
-    )
-    ext_sub = ET.SubElement(regpkg, "{%s}ExternalIdentifier" % SOAP_NS["rim"])
-    ext_sub.set("id", f"urn:uuid:{uuid.uuid4()}")
-    ext_sub.set("registryObject", regpkg.get("id"))
-    ext_sub.set("identificationScheme", SUBMISSIONSET_UNIQUEID_SCHEME)
-    ET.SubElement(ext_sub, "{%s}Value" % SOAP_NS["rim"]).text = submission_id
-
-    submission_time = obj.creation_time or datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    add_slot(regpkg, "submissionTime", [submission_time])
-    if obj.source_id:
-        add_slot(regpkg, "sourceId", [obj.source_id])
-    if obj.repository_unique_id:
-        add_slot(regpkg, "repositoryUniqueID", [obj.repository_unique_id])
-
-    # ExtrinsicObject (DocumentEntry)
-    doc_id = obj.unique_id or f"urn:uuid:{uuid.uuid4()}"
-    ex = ET.SubElement(rol, "{%s}ExtrinsicObject" % SOAP_NS["rim"])
-    ex.set("id", doc_id)
-    ex.set("objectType", obj.object_type or OBJECTTYPE_ONDEMAND)
-    ex.set("mimeType", obj.mime_type or "text/xml")
-    name = ET.SubElement(ex, "{%s}Name" % SOAP_NS["rim"])
-    ET.SubElement(name, "{%s}LocalizedString" % SOAP_NS["rim"]).set(
-        "value", "Clinical Document"
-    )
-    desc = ET.SubElement(ex, "{%s}Description" % SOAP_NS["rim"])
-    ET.SubElement(desc, "{%s}LocalizedString" % SOAP_NS["rim"]).set(
-        "value", "Document (CDA or other)"
+        if obj.practice_setting_code:
+            add_slot(xf, "practiceSettingCode", [obj.practice_setting_code])
+        if obj.repository_unique_id:
+            add_slot(xf, "repositoryUniqueID", [obj.repository_unique_id])
+
+
+def _write_association(xf, ids, regpkg_id: str, doc_id: str):
+    attrs = {
+        "id": f"urn:uuid:{next(ids)}",
+        "associationType": "urn:oasis:names:tc:ebxml-regrep:AssociationType:HasMember",
+        "sourceObject": regpkg_id,
+        "targetObject": doc_id,
+        "status": "urn:oasis:names:tc:ebxml-regrep:StatusType:Approved",
+    }
+    with xf.element(_TAG_ASSOCIATION, attrs):
+        pass
+
+
+def _write_document(
+    xf, obj: SOAPInput, doc_id: str, doc_b64: str, xop_cid: Optional[str]
+):
+    # Inline base64 for small documents; MTOM callers get an XOP include
+    # pointing at the binary MIME part instead
+    attrs = {"id": doc_id, "mimeType": obj.mime_type or "text/xml"}
+    with xf.element("Document", attrs):
+        if xop_cid is not None:
+            with xf.element(
+                _TAG_XOP_INCLUDE,
+                {"href": f"cid:{xop_cid}"},
+                nsmap={"xop": XOP_NS},
+            ):
+                pass
+            return
+        xf.write(doc_b64)
+
+
+def _pct(v):
+    # literal '%' in user values must not be mistaken for a skeleton slot
+    return v.replace("%", "%%") if isinstance(v, str) else v
+
+
+@functools.lru_cache(maxsize=512)
+def _iti41_skeleton(
+    soap: Tuple[Tuple[str, Any], ...],
+    meta: Tuple[Optional[str], ...],
+    has_doc: bool,
+    emit_xop: bool,
+) -> Tuple[Tuple[bytes, ...], Tuple[bytes, ...], str]:
+    """
+    Render the envelope for one metadata combination with %(name)s
+    placeholders for the MessageID (mid), the generated ids (u1..u9; u0 is
+    the default MessageID), the default creation time (ctime), the hash/size
+    slots and the document text (doc), then split it once into literal chunks
+    and slot names.
+
+    Returns (literals, slots, doc_id): literals has one more entry than slots
+    and doc_id is still a %-template.
+    """
+    obj = SOAPInput.model_construct(
+        soap={**{k: _pct(v) for k, v in soap}, "message_id": "%(mid)s"},
+        **{f: _pct(v) for f, v in zip(_ITI41_META_FIELDS, meta)},
     )
-    if obj.class_code:
-        cls = ET.SubElement(ex, "{%s}Classification" % SOAP_NS["rim"])
-        cls.set("classificationScheme", "urn:ksa-ehealth:classcodes:2023")
-        cls.set("classificationNode", obj.class_code)
-        cls.set("id", f"urn:uuid:{uuid.uuid4()}")
-
-    if obj.type_code:
-        tcls = ET.SubElement(ex, "{%s}Classification" % SOAP_NS["rim"])
-        tcls.set(
-            "classificationScheme", "urn:uuid:aa543740-bdda-424e-8c96-df4873be8500"
+    ids = iter([f"%(u{i})s" for i in range(1, ITI41_MAX_UUIDS)])
+    submission_id = obj.unique_id or f"urn:uuid:{next(ids)}"
+    regpkg_id = f"rs.{submission_id}"
+    doc_id = obj.unique_id or f"urn:uuid:{next(ids)}"
+    cid = f"{doc_id}@example.com" if emit_xop and has_doc else None
+    # submissionTime and creationTime share one default "now"
+    creation_time = obj.creation_time or "%(ctime)s"
+    doc_digest = ("%(hash)s", "%(size)s") if has_doc else None
+
+    buf = io.BytesIO()
+    with ET.xmlfile(buf, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(_TAG_ENVELOPE, nsmap=SOAP_NS):
+            _write_soap_header(xf, obj, ids)
+            with xf.element(_TAG_BODY):
+                with xf.element(_TAG_PNR_REQUEST):
+                    with xf.element(_TAG_SUBMIT_OBJECTS):
+                        with xf.element(_TAG_OBJECT_LIST):
+                            _write_submission_set(
+                                xf, obj, ids, regpkg_id, submission_id, creation_time
+                            )
+                            _write_document_entry(
+                                xf, obj, ids, doc_id, doc_digest, creation_time
+                            )
+                            _write_association(xf, ids, regpkg_id, doc_id)
+                    if has_doc:
+                        _write_document(xf, obj, doc_id, "%(doc)s", cid)
+
+    # escapes and slots are tokenized together so '%%(u0)s' from user input
+    # stays the literal text '%(u0)s' instead of opening a slot
+    pieces = _RE_SKELETON_TOKEN.split(buf.getvalue())
+    literals, slots, current = [], [], [pieces[0]]
+    for slot, literal in zip(pieces[1::2], pieces[2::2]):
+        if slot is None:
+            current.append(b"%")
+        else:
+            literals.append(b"".join(current))
+            slots.append(slot)
+            current = []
+        current.append(literal)
+    literals.append(b"".join(current))
+    return tuple(literals), tuple(slots), doc_id
+
+
+def _render_skeleton(literals, slots, values) -> bytes:
+    out = [literals[0]]
+    for slot, literal in zip(slots, literals[1:]):
+        out.append(values[slot])
+        out.append(literal)
+    return b"".join(out)
+
+
+def build_iti41_ebxml(
+    obj: SOAPInput, emit_xop: bool = False
+) -> Union[bytes, Tuple[bytes, bytes, str]]:
+    """
+    Fill the cached envelope skeleton for this payload's metadata with the
+    per-request ids, timestamps and document; templated submissions that only
+    differ in their document reuse one rendered skeleton.
+
+    Returns the UTF-8 encoded envelope. With emit_xop=True the <Document>
+    carries an xop:Include instead of inline base64 and
+    (xml_bytes, doc_bytes, cid) is returned for the MTOM packager.
+    """
+    if obj.source_id and not obj.source_id.startswith(NATIONAL_ORG_ROOT):
+        raise HTTPException(
+            status_code=400, detail=f"source_id must start with {NATIONAL_ORG_ROOT}"
         )
-        tcls.set("classificationNode", obj.type_code)
-        tcls.set("id", f"urn:uuid:{uuid.uuid4()}")
 
-    # ExternalIdentifiers
-    ei_unique = ET.SubElement(ex, "{%s}ExternalIdentifier" % SOAP_NS["rim"])
-    ei_unique.set("id", f"urn:uuid:{uuid.uuid4()}")
-    ei_unique.set("registryObject", ex.get("id"))
-    ei_unique.set("identificationScheme", UNIQUEID_SCHEME)
-    ET.SubElement(ei_unique, "{%s}Value" % SOAP_NS["rim"]).text = doc_id
-
-    ei_patient = ET.SubElement(ex, "{%s}ExternalIdentifier" % SOAP_NS["rim"])
-    ei_patient.set("id", f"urn:uuid:{uuid.uuid4()}")
-    ei_patient.set("registryObject", ex.get("id"))
-    ei_patient.set("identificationScheme", UNIQUEID_SCHEME)
-    ET.SubElement(ei_patient, "{%s}Value" % SOAP_NS["rim"]).text = obj.patient_id
-
-    if obj.source_id:
-        ei_src = ET.SubElement(ex, "{%s}ExternalIdentifier" % SOAP_NS["rim"])
-        ei_src.set("id", f"urn:uuid:{uuid.uuid4()}")
-        ei_src.set("registryObject", ex.get("id"))
-        ei_src.set("identificationScheme", UNIQUEID_SCHEME)
-        ET.SubElement(ei_src, "{%s}Value" % SOAP_NS["rim"]).text = obj.source_id
-
-    # creationTime slot
-    creation_time = obj.creation_time or datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    add_slot(ex, "creationTime", [creation_time])
-
-    # Document bytes: compute hash/size/formatCode and attach demo Document element
-    doc_bytes = None
+    # Document bytes: needed up front for the hash/size slots
+    doc_bytes = doc_b64 = None
     if obj.document_base64:
-        try:
-            doc_bytes = base64.b64decode(obj.document_base64)
-        except Exception:
-            doc_bytes = obj.document_base64.encode("utf-8")
+        doc_bytes, doc_b64 = decode_document(obj.document_base64, not emit_xop)
 
-    if doc_bytes is not None:
-        h, size = sha1_and_size(doc_bytes)
-        add_slot(ex, "hash", [h])
-        add_slot(ex, "size", [size])
-        fmt = (
-            "urn:ihe:iti:xds-sd:pdf:2008"
-            if "pdf" in (obj.mime_type or "").lower()
-            else "urn:ksa-ehealth:format:unknown"
-        )
-        add_slot(ex, "formatCode", [fmt])
-        # Demo embedding (production: use MTOM/XOP or a separate document repository)
-        doc_el = ET.SubElement(pr, "Document")
-        doc_el.set("id", ex.get("id"))
-        doc_el.set("mimeType", obj.mime_type or "text/xml")
-        doc_el.text = base64.b64encode(doc_bytes).decode("utf-8")
-
-    if obj.practice_setting_code:
-        add_slot(ex, "practiceSettingCode", [obj.practice_setting_code])
-    if obj.repository_unique_id:
-        add_slot(ex, "repositoryUniqueID", [obj.repository_unique_id])
-
-    assoc = ET.SubElement(rol, "{%s}Association" % SOAP_NS["rim"])
-    assoc.set("id", f"urn:uuid:{uuid.uuid4()}")
-    assoc.set(
-        "associationType", "urn:oasis:names:tc:ebxml-regrep:AssociationType:HasMember"
+    soap = tuple((k, obj.soap[k]) for k in _ITI41_SOAP_KEYS if k in obj.soap)
+    meta = tuple(getattr(obj, f) for f in _ITI41_META_FIELDS)
+    literals, slots, doc_id = _iti41_skeleton(
+        soap, meta, doc_bytes is not None, emit_xop
     )
-    assoc.set("sourceObject", regpkg.get("id"))
-    assoc.set("targetObject", ex.get("id"))
-    assoc.set("status", "urn:oasis:names:tc:ebxml-regrep:StatusType:Approved")
 
-    xml_text = ET.tostring(root, encoding="utf-8", xml_declaration=True).decode("utf-8")
+    # every UUID this envelope can need, drawn from one urandom read
+    values = {
+        b"u%d" % i: str(u).encode("ascii")
+        for i, u in enumerate(_uuid_batch(ITI41_MAX_UUIDS))
+    }
+    if "message_id" in obj.soap:
+        values[b"mid"] = xml_escape(obj.soap["message_id"]).encode("utf-8")
+    else:
+        values[b"mid"] = values[b"u0"]
+    if not obj.creation_time:
+        values[b"ctime"] = ts_to_hl7(None).encode("ascii")
+    cid = None
+    if doc_bytes is not None:
+        h, size = sha1_and_size(doc_bytes)
+        values[b"hash"] = h.encode("ascii")
+        values[b"size"] = size.encode("ascii")
+        if doc_b64 is not None:
+            values[b"doc"] = doc_b64
+        if emit_xop:
+            cid = (doc_id.encode("utf-8") % values).decode("utf-8") + "@example.com"
+    xml_bytes = _render_skeleton(literals, slots, values)
+
+    # Optional: XSD validation if an XSD path is configured (placeholder)
+    # NOTE: You must supply an XSD for full XDS validation to be meaningful. This is a placeholder.
+    try:
+        # Example: load local xsd file(s) and validate. Not included by default.
+        # xsd_doc = ET.parse("xds-b_regrep.xsd")
+        # schema = ET.XMLSchema(xsd_doc)
+        # xml_doc = ET.fromstring(xml_bytes)
+        # schema.assertValid(xml_doc)
+        pass
+    except Exception as e:
+        logger.warning("ITI-41 XSD validation failed: %s", e)
+        # do not block; in strict mode we would raise
+    if emit_xop:
+        return xml_bytes, doc_bytes, cid
+    return xml_bytes
 
-    # Optional: XSD validation if lxml is available and XSD path configured (placeholder)
-    if LXML_AVAILABLE:
-        # NOTE: You must supply an XSD for full XDS validation to be meaningful. This is a placeholder.
-        try:
-            # Example: load local xsd file(s) and validate. Not included by default.
-            # xsd_doc = lxml_etree.parse("xds-b_regrep.xsd")
-            # schema = lxml_etree.XMLSchema(xsd_doc)
-            # xml_doc = lxml_etree.fromstring(xml_text.encode('utf-8'))
-            # schema.assertValid(xml_doc)
-            pass
-        except Exception as e:
-            logger.warning(f"ITI-41 XSD validation failed: {e}")
-            # do not block; in strict mode we would raise
-    return xml_text
 
-def build_soap_fault(code: str, reason: str, detail: str = None) -> str:
+def build_soap_fault(code: str, reason: str, detail: str = None) -> bytes:
     """
     Build a SOAP 1.2 Fault message according to IHE XDS.b error structure.
     """
-    fault = ET.Element("{http://www.w3.org/2003/05/soap-envelope}Envelope")
-    body = ET.SubElement(fault, "{http://www.w3.org/2003/05/soap-envelope}Body")
-    fault_el = ET.SubElement(body, "{http://www.w3.org/2003/05/soap-envelope}Fault")
+    fault = ET.Element(_TAG_ENVELOPE, nsmap={"s": SOAP_NS["s"]})
+    body = ET.SubElement(fault, _TAG_BODY)
+    fault_el = ET.SubElement(body, _TAG_FAULT)
 
     code_el = ET.SubElement(fault_el, "Code")
     ET.SubElement(code_el, "Value").text = f"s:{code}"
@@ -686,55 +1076,97 @@ def build_soap_fault(code: str, reason: str, detail: str = None) -> str:
         detail_el = ET.SubElement(fault_el, "Detail")
         ET.SubElement(detail_el, "Error").text = detail
 
-    return ET.tostring(fault, encoding="utf-8", xml_declaration=True).decode("utf-8")
+    return ET.tostring(
+        fault, encoding="utf-8", xml_declaration=True, pretty_print=False
+    )
 
 
 # ----------------------------
 # ITI-41 -> JSON (Robust, namespace-agnostic)
 # ----------------------------
-def iti41_xml_to_json(xml_text: str) -> Dict[str, Any]:
+def _local_name_query(name: str):
+    """
+    Compile a namespace-agnostic descendant XPath for elements named *name*.
+    """
+    return ET.XPath(f".//*[local-name()='{name}']")
+
+
+_XP_EI = _local_name_query("ExternalIdentifier")
+_XP_SLOT = _local_name_query("Slot")
+_XP_VALUE = _local_name_query("Value")
+
+# iterparse only reports these; "{*}" keeps the match namespace-agnostic
+_ITERPARSE_TAGS = ("{*}ExtrinsicObject", "{*}RegistryPackage")
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def _extrinsic_to_json(extrinsic, out: Dict[str, Any]) -> None:
+    out["document_id"] = extrinsic.get("id")
+    out["mimeType"] = extrinsic.get("mimeType")
+    out["objectType"] = extrinsic.get("objectType")
+    # ExternalIdentifiers
+    vals = []
+    for ei in _XP_EI(extrinsic):
+        # Value element may be nested
+        v_el = _first(_XP_VALUE(ei))
+        if v_el is not None and v_el.text:
+            vals.append(v_el.text)
+    out["externalIdentifiers"] = vals
+
+    # Slots under ExtrinsicObject
+    for slot in _XP_SLOT(extrinsic):
+        name = slot.get("name")
+        v_el = _first(_XP_VALUE(slot))
+        if name and v_el is not None and v_el.text:
+            out[name] = v_el.text
+
+
+def _submission_time_to_json(regpkg, out: Dict[str, Any]) -> None:
+    for slot in _XP_SLOT(regpkg):
+        if slot.get("name") == "submissionTime":
+            v = _first(_XP_VALUE(slot))
+            if v is not None and v.text:
+                out["submissionTime"] = v.text
+
+
+def iti41_xml_to_json(xml_text: Union[str, bytes]) -> Dict[str, Any]:
     """
-    Robust extractor: removes namespace decoration and searches by local tag names.
+    Robust extractor: searches by local tag names regardless of namespace.
     Returns a dict with document_id, mimeType, objectType, externalIdentifiers and slots/submissionTime where present.
+    Accepts the envelope as text or as already-encoded bytes. Parsed elements
+    are released as the parse advances, so memory stays flat on large bundles.
     """
     try:
-        # Remove namespace prefixes by re-parsing and stripping namespace URIs
-        it = ET.iterparse(io.StringIO(xml_text))
-        for _, el in it:
-            if isinstance(el.tag, str) and "}" in el.tag:
-                el.tag = el.tag.split("}", 1)[1]
-        root = it.root
+        if isinstance(xml_text, str):
+            xml_text = xml_text.encode("utf-8")
 
         out: Dict[str, Any] = {}
-        extrinsic = root.find(".//ExtrinsicObject")
-        if extrinsic is not None:
-            out["document_id"] = extrinsic.get("id")
-            out["mimeType"] = extrinsic.get("mimeType")
-            out["objectType"] = extrinsic.get("objectType")
-            # ExternalIdentifiers
-            vals = []
-            for ei in extrinsic.findall(".//ExternalIdentifier"):
-                # Value element may be nested
-                v_el = ei.find(".//Value")
-                if v_el is not None and v_el.text:
-                    vals.append(v_el.text)
-            out["externalIdentifiers"] = vals
-
-            # Slots under ExtrinsicObject
-            for slot in extrinsic.findall(".//Slot"):
-                name = slot.get("name")
-                v_el = slot.find(".//Value")
-                if name and v_el is not None and v_el.text:
-                    out[name] = v_el.text
-
-        # RegistryPackage submissionTime
-        regpkg = root.find(".//RegistryPackage")
-        if regpkg is not None:
-            for slot in regpkg.findall(".//Slot"):
-                if slot.get("name") == "submissionTime":
-                    v = slot.find(".//Value")
-                    if v is not None and v.text:
-                        out["submissionTime"] = v.text
+        seen_extrinsic = seen_regpkg = False
+        # entities stay unexpanded and nothing is fetched over the network
+        context = ET.iterparse(
+            io.BytesIO(xml_text),
+            tag=_ITERPARSE_TAGS,
+            huge_tree=True,
+            remove_blank_text=True,
+            resolve_entities=False,
+            no_network=True,
+        )
+        for _, el in context:
+            if el.tag.endswith("ExtrinsicObject"):
+                # only the first DocumentEntry is reported
+                if not seen_extrinsic:
+                    seen_extrinsic = True
+                    _extrinsic_to_json(el, out)
+            elif not seen_regpkg:
+                # RegistryPackage submissionTime
+                seen_regpkg = True
+                _submission_time_to_json(el, out)
+            el.clear(keep_tail=True)
+            while el.getprevious() is not None:
+                del el.getparent()[0]
 
         return out
 
@@ -748,63 +1180,98 @@ def iti41_xml_to_json(xml_text: str) -> Dict[str, Any]:
 # ----------------------------
 
 
-def build_iti41_mtom_envelope(xml_text: str, doc_id: str, mime_type: str) -> str:
+async def _iter_mtom(head: bytes, doc_bytes: bytes, close: bytes):
     """
-    Replace <Document> content with MTOM XOP include reference.
+    Yield the multipart/related body: the framing plus XOP envelope chunk,
+    then the binary document sliced through a memoryview so it is never
+    copied into one big buffer, then the closing delimiter.
     """
-    xop_ref = f'<xop:Include href="cid:{doc_id}@example.com" xmlns:xop="http://www.w3.org/2004/08/xop/include"/>'
-    # Replace <Document>...</Document> with the XOP include
-    xml_text = re.sub(
-        rf'<Document id="{re.escape(doc_id)}"[^>]*>.*?</Document>',
-        f'<Document id="{doc_id}" mimeType="{mime_type}">{xop_ref}</Document>',
-        xml_text,
-        flags=re.DOTALL,
-    )
-    return xml_text
+    # async so StreamingResponse iterates inline; nothing here blocks, and a
+    # sync generator would cost a threadpool hop per slice
+    yield head
+    view = memoryview(doc_bytes)
+    for i in range(0, len(view), MTOM_CHUNK_SIZE):
+        yield view[i : i + MTOM_CHUNK_SIZE]
+    yield close
 
 
 def create_mtom_multipart(
-    xml_envelope: str, doc_bytes: bytes, mime_type: str, doc_id: str
+    xml_envelope: bytes, doc_bytes: bytes, mime_type: str, cid: str
 ):
     """
     Create multipart/related payload with XOP include and binary doc part.
+    Returns a body iterator for StreamingResponse and the response headers;
+    every part's size is known up front, so Content-Length is included.
     """
-    boundary = f"uuid:{uuid.uuid4()}"
-    cid = f"{doc_id}@example.com"
-
-    # Use requests-toolbelt MultipartEncoder
-    m = MultipartEncoder(
-        fields={
-            "rootpart": (
-                "envelope.xml",
-                xml_envelope.encode("utf-8"),
-                'application/xop+xml; type="text/xml"; charset=UTF-8',
-            ),
-            cid: ("document.bin", doc_bytes, mime_type),
-        },
-        boundary=boundary,
+    boundary = f"uuid:{uuid.uuid4()}".encode("ascii")
+    delimiter = _MTOM_DELIMITER % boundary
+    # all framing plus the envelope go out as a single ASGI send
+    head = b"".join(
+        (
+            delimiter,
+            _MTOM_ROOT_PART_HEADERS,
+            xml_envelope,
+            b"\r\n",
+            delimiter,
+            _MTOM_DOC_PART_HEADERS % (mime_type.encode("utf-8"), cid.encode("utf-8")),
+        )
     )
+    close = _MTOM_CLOSE % boundary
+
+    body = _iter_mtom(head, doc_bytes, close)
 
     headers = {
-        "Content-Type": f'multipart/related; type="application/xop+xml"; boundary="{boundary}"'
+        "Content-Type": _MTOM_CONTENT_TYPE % boundary.decode("ascii"),
+        "Content-Length": str(len(head) + len(doc_bytes) + len(close)),
     }
 
-    return m, headers
+    return body, headers
 
 
 # ----------------------------
 # Middleware logging
 # ----------------------------
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"[REQ] {request.method} {request.url.path}")
-    try:
-        response = await call_next(request)
-    except Exception:
-        logger.exception("Unhandled error during request")
-        raise
-    logger.info(f"[RES] {request.method} {request.url.path} -> {response.status_code}")
-    return response
+class AccessLogMiddleware:
+    """
+    Pure ASGI request/response logger. Unlike @app.middleware("http") it does
+    not route bodies through BaseHTTPMiddleware's memory streams or spawn a
+    task per request; it only peeks at the response status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path = scope["path"]
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        log_info = logger.isEnabledFor(logging.INFO)
+        if log_info:
+            logger.info("[REQ] %s %s", method, path)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            # ServerErrorMiddleware (outside this one) answers with the 500 and
+            # the server logs the traceback; only the access line is added here
+            if log_info:
+                logger.info("[RES] %s %s -> %s", method, path, 500)
+            raise
+        if log_info:
+            logger.info("[RES] %s %s -> %s", method, path, status_code)
+
+
+app.add_middleware(AccessLogMiddleware)
 
 
 # ----------------------------
@@ -812,156 +1279,146 @@ async def log_requests(request: Request, call_next):
 # ----------------------------
 
 
+# payloads larger than this are converted in the threadpool so one big message
+# does not stall the event loop; typical small messages run inline
+OFFLOAD_THRESHOLD_BYTES = 32 * 1024
+
+
+async def _convert(size: int, fn, *args):
+    if size > OFFLOAD_THRESHOLD_BYTES:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
 @app.post("/convert/json-to-hl7")
-def api_json_to_hl7(payload: HL7FullInput):
+async def api_json_to_hl7(payload: HL7FullInput, request: Request):
+    """
+    Returns {"hl7": ...} by default; clients sending
+    'Accept: application/hl7-v2' get the raw pipe-delimited message instead.
+    """
     logger.info("Received JSON→HL7 conversion request")
-    try:
-        hl7 = json_to_hl7_full(payload)
-        logger.info("HL7 conversion success")
-        return {"hl7": hl7}
-    except HTTPException as e:
-        logger.error(f"HL7 conversion failed: {getattr(e, 'detail', str(e))}")
-        raise
-    except Exception as e:
-        logger.exception("Unexpected error during HL7 conversion")
-        raise HTTPException(status_code=500, detail=str(e))
+    size = int(request.headers.get("content-length") or 0)
+    hl7 = await _convert(size, json_to_hl7_full, payload)
+    logger.info("HL7 conversion success")
+    if HL7_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(content=hl7.encode("utf-8"), media_type=HL7_MEDIA_TYPE)
+    return {"hl7": hl7}
 
 
 @app.post("/convert/hl7-to-json")
-def api_hl7_to_json(body: Dict[str, str]):
+async def api_hl7_to_json(body: HL7Body):
     logger.info("Received HL7→JSON conversion request")
-    hl7_msg = body.get("hl7")
-    if not hl7_msg:
-        logger.error("HL7→JSON conversion failed: missing 'hl7' field")
-        raise HTTPException(status_code=400, detail="Provide 'hl7' field")
-    try:
-        parsed = hl7_full_to_json(hl7_msg)
-        logger.info("HL7→JSON conversion success")
-        return {"json": parsed}
-    except HTTPException as e:
-        logger.error(f"HL7→JSON conversion failed: {getattr(e, 'detail', str(e))}")
-        raise
-    except Exception as e:
-        logger.exception("Unexpected error during HL7→JSON conversion")
-        raise HTTPException(status_code=500, detail=str(e))
+    hl7_msg = body.hl7
+    parsed = await _convert(len(hl7_msg), hl7_full_to_json, hl7_msg)
+    logger.info("HL7→JSON conversion success")
+    return {"json": parsed}
 
 
 @app.post("/convert/json-to-iti41")
 def api_json_to_iti41(payload: SOAPInput):
-    logger.info("Received JSON→iti41 conversion request")
-
     """
     Convert JSON payload to ITI-41 ebXML or MTOM/XOP multipart message.
     - If document < 256KB => inline Base64 in XML.
     - If document >= 256KB => use MTOM/XOP.
     """
+    logger.info("Received JSON→iti41 conversion request")
     try:
-        xml = build_iti41_ebxml(payload)
-
-        # If no document, just return XML
-        if not payload.document_base64:
-            logger.info("ITI-41 build success (no document)")
-            return Response(content=xml, media_type="application/xml")
-
-        # Determine size in bytes
-        try:
-            doc_bytes = base64.b64decode(payload.document_base64)
-        except Exception:
-            doc_bytes = payload.document_base64.encode("utf-8")
-
-        doc_size_kb = len(doc_bytes) / 1024.0
-        doc_id = payload.unique_id or "urn:uuid:doc-1"
-
-        if doc_size_kb < 256:
-            logger.info("ITI-41 build success (inline document)")
-            return Response(content=xml, media_type="application/xml")
-
-        # large: use MTOM
-        xml_xop = build_iti41_mtom_envelope(
-            xml, doc_id, payload.mime_type or "text/xml"
-        )
-        multipart, headers = create_mtom_multipart(
-            xml_xop, doc_bytes, payload.mime_type or "text/xml", doc_id
-        )
+        # Decoded size follows from the base64 length; the builder does the
+        # one real decode it needs for the hash/size slots
+        b64 = payload.document_base64 or ""
+        doc_size = (len(b64) - b64.count("=")) * 3 // 4
+
+        if doc_size < _MTOM_THRESHOLD_BYTES:
+            mode = "inline document" if payload.document_base64 else "no document"
+            response = Response(
+                content=build_iti41_ebxml(payload), media_type=SOAP_MEDIA_TYPE
+            )
+        else:
+            # large: use MTOM, the envelope references the binary part via XOP
+            mode = "MTOM multipart"
+            xml_xop, doc_bytes, cid = build_iti41_ebxml(payload, emit_xop=True)
+            multipart, headers = create_mtom_multipart(
+                xml_xop, doc_bytes, payload.mime_type or "text/xml", cid
+            )
+            response = StreamingResponse(
+                multipart, media_type=headers["Content-Type"], headers=headers
+            )
 
-        logger.info("ITI-41 build success (MTOM multipart)")
-        return Response(
-            content=multipart.to_string(), media_type=headers["Content-Type"]
-        )
+        logger.info("ITI-41 build success (%s)", mode)
+        return response
 
-    except HTTPException as e:
-        logger.error(f"ITI-41 conversion failed: {getattr(e, 'detail', str(e))}")
+    except HTTPException:
         raise
     except Exception as e:
+        # ITI-41 callers expect a SOAP fault rather than the JSON 500 body
         logger.exception("ITI-41 conversion failed")
         fault_xml = build_soap_fault("Receiver", "Processing Failure", str(e))
-        return Response(content=fault_xml, media_type="application/soap+xml", status_code=500)
+        return Response(content=fault_xml, media_type=SOAP_MEDIA_TYPE, status_code=500)
 
 
 
 @app.post("/convert/iti41-to-json")
-def api_iti41_to_json(body: Dict[str, str]):
+async def api_iti41_to_json(body: XmlBody):
     logger.info("Received ITI-41→JSON conversion request")
-    xml = body.get("xml")
-    if not xml:
-        logger.error("ITI-41→JSON conversion failed: missing 'xml' field")
-        raise HTTPException(status_code=400, detail="Provide 'xml' field")
-    try:
-        out = iti41_xml_to_json(xml)
-        logger.info("ITI-41→JSON conversion success")
-        return {"json": out}
-    except HTTPException as e:
-        logger.error(f"ITI-41→JSON conversion failed: {getattr(e, 'detail', str(e))}")
-        raise
-    except Exception as e:
-        logger.exception("Unexpected error during ITI-41→JSON conversion")
-        raise HTTPException(status_code=500, detail=str(e))
+    xml = body.xml
+    out = await _convert(len(xml), iti41_xml_to_json, xml)
+    logger.info("ITI-41→JSON conversion success")
+    return {"json": out}
+
+
+# serialized once at import: the examples are static apart from a message id
+# that does not need to change between calls
+_EXAMPLE_HL7_INPUT = {
+    "header": {
+        "event": "ADT^A01",
+        "sending_app_oid": "2.16.840.1.113883.3.3731.example.ehr",
+        "sending_facility": "HospitalA",
+        "message_datetime": "2025-10-21T12:30:00Z",
+        "message_control_id": "MSG0001",
+    },
+    "patient": {
+        "identifiers": [
+            {
+                "id": "NHIC123456",
+                "assigning_authority": ASSIGNING_AUTHORITY_HEALTH_ID,
+            }
+        ],
+        "name_family": "Doe",
+        "name_given": "John",
+        "dob": "19800101",
+        "sex": "M",
+    },
+}
+
+_EXAMPLE_ITI41_INPUT = {
+    "soap": {
+        "action": "urn:ihe:iti:2007:ProvideAndRegisterDocumentSet-b",
+        "message_id": str(uuid.uuid4()),
+        "to": "https://nphies.example/iti41",
+    },
+    "repository_address": "https://repo.example",
+    "patient_id": f"NHIC123456^^^&{ASSIGNING_AUTHORITY_HEALTH_ID}&ISO",
+    "class_code": "REPORTS",
+    "type_code": "11369-6",
+    "unique_id": "urn:uuid:doc-1",
+    "document_base64": "ZG9jdW1lbnRjb250ZW50",
+    "mime_type": "text/xml",
+    "creation_time": "20251021T123000Z",
+    "source_id": NATIONAL_ORG_ROOT + ".12345",
+    "repository_unique_id": NATIONAL_ORG_ROOT + ".repo.1",
+}
+
+_EXAMPLE_PAYLOAD = orjson.dumps(
+    {
+        "hl7_input_example": _EXAMPLE_HL7_INPUT,
+        "iti41_input_example": _EXAMPLE_ITI41_INPUT,
+    }
+)
 
 
 @app.get("/example")
-def examples():
-    example_hl7_input = {
-        "header": {
-            "event": "ADT^A01",
-            "sending_app_oid": "2.16.840.1.113883.3.3731.example.ehr",
-            "sending_facility": "HospitalA",
-            "message_datetime": "2025-10-21T12:30:00Z",
-            "message_control_id": "MSG0001",
-        },
-        "patient": {
-            "identifiers": [
-                {
-                    "id": "NHIC123456",
-                    "assigning_authority": ASSIGNING_AUTHORITY_HEALTH_ID,
-                }
-            ],
-            "name_family": "Doe",
-            "name_given": "John",
-            "dob": "19800101",
-            "sex": "M",
-        },
-    }
-    example_iti41_input = {
-        "soap": {
-            "action": "urn:ihe:iti:2007:ProvideAndRegisterDocumentSet-b",
-            "message_id": str(uuid.uuid4()),
-            "to": "https://nphies.example/iti41",
-        },
-        "repository_address": "https://repo.example",
-        "patient_id": f"NHIC123456^^^&{ASSIGNING_AUTHORITY_HEALTH_ID}&ISO",
-        "class_code": "REPORTS",
-        "type_code": "11369-6",
-        "unique_id": "urn:uuid:doc-1",
-        "document_base64": "ZG9jdW1lbnRjb250ZW50",
-        "mime_type": "text/xml",
-        "creation_time": "20251021T123000Z",
-        "source_id": NATIONAL_ORG_ROOT + ".12345",
-        "repository_unique_id": NATIONAL_ORG_ROOT + ".repo.1",
-    }
-    return {
-        "hl7_input_example": example_hl7_input,
-        "iti41_input_example": example_iti41_input,
-    }
+async def examples():
+    return Response(_EXAMPLE_PAYLOAD, media_type="application/json")
 
 
 # End of file
@@ -0,0 +1,33 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from fastapi.testclient import TestClient
+from mapper_service_final import app, ASSIGNING_AUTHORITY_HEALTH_ID
+
+client = TestClient(app, raise_server_exceptions=False)
+
+def test_unhandled_error_returns_json_500():
+    payload = {
+        "header": {"event": "ADT^A01"},
+        "patient": {
+            "identifiers": [{"id": "NHIC123", "assigning_authority": ASSIGNING_AUTHORITY_HEALTH_ID}],
+            "name_family": "Doe",
+            "name_given": "John",
+            "dob": "19800101",
+            "sex": "M",
+        },
+        # a non-string allergen fails inside the HL7 builder
+        "al1": [{"allergen": 5}],
+    }
+    res = client.post("/convert/json-to-hl7", json=payload)
+    assert res.status_code == 500
+    assert res.headers["content-type"] == "application/json"
+    assert isinstance(res.json()["detail"], str)
+
+def test_missing_or_empty_body_field_is_422():
+    for path, field in (("/convert/hl7-to-json", "hl7"), ("/convert/iti41-to-json", "xml")):
+        for body in ({}, {field: ""}):
+            res = client.post(path, json=body)
+            assert res.status_code == 422
+            assert res.json()["detail"][0]["loc"] == ["body", field]
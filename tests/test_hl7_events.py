@@ -8,7 +8,8 @@ def build_base(event):
     header = MessageModel(event=event, sending_app_oid="2.16.840.1.113883.3.3731.test", sending_facility="HOSP", message_datetime="2025-10-21T12:30:00Z", message_control_id="MSG01")
     patient = PatientModel(identifiers=[Identifier(id="NHIC123", assigning_authority="2.16.840.1.113883.3.3731.1.1.100.1")], name_family="Doe", name_given="John", dob="19800101", sex="M")
     visit = VisitModel(patient_class="I", location="Ward^01^01", attending_doctor_id="123", attending_doctor_family="Ali", attending_doctor_given="Ahmed", visit_number="V1", admit_datetime="2025-10-21T10:00:00Z")
-    return HL7FullInput(header=header, patient=patient, visit=visit)
+    # sub-models are validated above; skip revalidating the envelope
+    return HL7FullInput.model_construct(header=header, patient=patient, visit=visit)
 
 def test_adt_a01_roundtrip():
     inp = build_base("ADT^A01")
@@ -34,3 +35,8 @@ def test_adt_a31_roundtrip():
     hl7 = json_to_hl7_full(inp)
     parsed = hl7_full_to_json(hl7)
     assert parsed['header']['event']
+
+def test_escape_hl7_field():
+    from mapper_service_final import escape_hl7_field
+    assert escape_hl7_field("A|B^C&D~E") == "A\\F\\B\\S\\C\\T\\D\\R\\E"
+    assert escape_hl7_field(None) == ""
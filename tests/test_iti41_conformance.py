@@ -1,3 +1,5 @@
+import asyncio
+import re
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -25,4 +27,90 @@ def test_iti41_mtom_switch():
     )
     res = api_json_to_iti41(payload)
     assert "multipart/related" in res.media_type
-    assert b"xop:Include" in res.body
+
+    async def read_body():
+        return b"".join([bytes(chunk) async for chunk in res.body_iterator])
+
+    body = asyncio.run(read_body())
+    assert int(res.headers["content-length"]) == len(body)
+    assert b"xop:Include" in body
+    assert 'start="<rootpart>"' in res.media_type
+    assert b"Content-ID: <rootpart>" in body
+    # the XOP reference must resolve to the binary part's Content-ID
+    cid = re.search(rb'href="cid:([^"]+)"', body).group(1)
+    assert b"Content-ID: <" + cid + b">\r\n" in body
+    assert b"A" * 300000 in body
+
+def test_iti41_roundtrip():
+    from mapper_service_final import iti41_xml_to_json, NATIONAL_ORG_ROOT
+    import base64
+    import hashlib
+
+    payload = SOAPInput(
+        soap={"action": "urn:ihe:iti:2007:ProvideAndRegisterDocumentSet-b", "message_id": "mid-1", "to": "https://repo.example"},
+        repository_address="https://repo.example",
+        patient_id=f"NHIC123^^^&2.16.840.1.113883.3.3731.1.1.100.1&ISO",
+        class_code="REPORTS",
+        type_code="11369-6",
+        unique_id="urn:uuid:doc-1",
+        document_base64=base64.b64encode(b"testdoc").decode("utf-8"),
+        mime_type="text/xml",
+        creation_time="20251021123000",
+        source_id=NATIONAL_ORG_ROOT + ".source",
+        repository_unique_id=NATIONAL_ORG_ROOT + ".repo"
+    )
+    xml = build_iti41_ebxml(payload)
+    parsed = iti41_xml_to_json(xml)
+    assert parsed["document_id"] == "urn:uuid:doc-1"
+    assert payload.patient_id in parsed["externalIdentifiers"]
+    assert parsed["hash"] == hashlib.sha1(b"testdoc").hexdigest()
+    assert parsed["size"] == "7"
+    assert parsed["submissionTime"] == "20251021123000"
+
+def test_sha1_and_size_file_object():
+    from mapper_service_final import sha1_and_size
+    import io
+
+    data = b"document" * 20000
+    assert sha1_and_size(io.BytesIO(data)) == sha1_and_size(data)
+
+def test_iti41_skeleton_reuse():
+    from mapper_service_final import iti41_xml_to_json
+    import base64
+    import hashlib
+
+    def build(doc):
+        payload = SOAPInput(
+            soap={"to": "https://repo.example/100%"},
+            patient_id=f"NHIC%1^^^&2.16.840.1.113883.3.3731.1.1.100.1&ISO",
+            document_base64=base64.b64encode(doc).decode("utf-8"),
+        )
+        return iti41_xml_to_json(build_iti41_ebxml(payload))
+
+    first, second = build(b"first"), build(b"second")
+    assert first["document_id"] != second["document_id"]
+    assert first["hash"] == hashlib.sha1(b"first").hexdigest()
+    assert second["hash"] == hashlib.sha1(b"second").hexdigest()
+    assert "NHIC%1^^^&2.16.840.1.113883.3.3731.1.1.100.1&ISO" in second["externalIdentifiers"]
+
+    # user text that looks like a skeleton slot must come through verbatim
+    for value in ("X%(u0)s", "X%(hash)s", "X%(nope)s", "X%%(doc)s"):
+        payload = SOAPInput(
+            soap={"to": "https://repo.example"},
+            patient_id=f"{value}^^^&2.16.840.1.113883.3.3731.1.1.100.1&ISO",
+            class_code=value,
+            document_base64=base64.b64encode(b"doc").decode("utf-8"),
+        )
+        xml = build_iti41_ebxml(payload)
+        parsed = iti41_xml_to_json(xml)
+        assert payload.patient_id in parsed["externalIdentifiers"]
+        assert f'classificationNode="{value}"'.encode("utf-8") in xml
+
+    # MessageID is filled per request, not baked into the cached skeleton
+    for message_id in ("mid-a", "mid-b&c"):
+        payload = SOAPInput(
+            soap={"message_id": message_id, "to": "https://repo.example"},
+            patient_id=f"NHIC1^^^&2.16.840.1.113883.3.3731.1.1.100.1&ISO",
+        )
+        xml = build_iti41_ebxml(payload)
+        assert b"<a:MessageID>" + message_id.replace("&", "&amp;").encode() in xml